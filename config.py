@@ -0,0 +1,25 @@
+import os
+import logging
+from functools import lru_cache
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Set in os.environ after the first load so re-imported modules (e.g. uvicorn --reload) skip re-parsing
+ENV_LOADED_FLAG = "_ENV_LOADED"
+
+
+@lru_cache(maxsize=1)
+def load_env_once() -> bool:
+    """
+    Load the .env file into the process environment, at most once per process.
+    
+    Returns:
+        True if the .env file was parsed by this call, False if it was already loaded
+    """
+    if ENV_LOADED_FLAG in os.environ:
+        return False
+    load_dotenv()
+    os.environ[ENV_LOADED_FLAG] = "1"
+    logger.info("[config.py] Environment variables loaded from .env")
+    return True
@@ -1,40 +1,32 @@
 import os
 import sys
-import traceback
 import logging
-from dotenv import load_dotenv
-import motor.motor_asyncio
+from typing import Final, Optional
+from config import load_env_once
+from pymongo import AsyncMongoClient
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - [%(filename)s:%(funcName)s:%(lineno)d] - %(message)s'
-)
+# Logging is configured once in main.py
 logger = logging.getLogger(__name__)
 
 def log_error(file: str, function: str, operation: str, error: Exception, context: dict = None):
     """Helper function to log errors with detailed context."""
-    error_info = {
-        "file": file,
-        "function": function,
-        "operation": operation,
-        "error_type": type(error).__name__,
-        "error_message": str(error),
-        "context": context or {},
-        "traceback": traceback.format_exc()
-    }
-    logger.error(f"[{file}.{function}] Error during {operation}: {error_info}")
-    return error_info
+    # Traceback and message are only formatted if a handler actually emits the record
+    logger.error(
+        "[%s.%s] Error during %s: %s: %s | context: %s",
+        file, function, operation, type(error).__name__, error, context or {},
+        exc_info=error,
+        extra={"context": context or {}}
+    )
 
 # Load environment variables
 try:
-    load_dotenv()
+    load_env_once()
     logger.info("[database.py] Environment variables loaded")
 except Exception as e:
     log_error("database.py", "startup", "loading .env file", e, {})
 
 # Get MongoDB URI
-MONGODB_URI = os.getenv("MONGODB_URI")
+MONGODB_URI: Final[Optional[str]] = os.getenv("MONGODB_URI")
 
 if not MONGODB_URI:
     logger.error("[database.py] CRITICAL: MONGODB_URI is None! Check .env file location and contents.")
@@ -59,7 +51,8 @@ threads_collection = None
 
 try:
     logger.info("[database.py] Initializing MongoDB client...")
-    client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URI)
+    # Single shared client for the whole process; minPoolSize keeps connections warm
+    client = AsyncMongoClient(MONGODB_URI, minPoolSize=10, maxPoolSize=50, serverSelectionTimeoutMS=3000)
     db = client.exim_db  # Using a default database name 'exim_db'
     threads_collection = db["threads"]
     logger.info("[database.py] MongoDB client initialized successfully")
@@ -71,4 +64,54 @@ except Exception as e:
     logger.error("[database.py] CRITICAL: Failed to initialize MongoDB connection!")
     logger.error("[database.py] The application may not function correctly without database connection.")
     # Create placeholder to prevent import errors - will fail on actual use
-    threads_collection = None
\ No newline at end of file
+    threads_collection = None
+
+async def ping_database():
+    """
+    Run a ping so the first connection (TLS + auth) is made at startup rather than on the first request.
+    The pool then fills up to minPoolSize in the background.
+    """
+    if client is None:
+        logger.error("[database.py] Skipping ping: MongoDB client is not initialized")
+        return
+
+    try:
+        await client.admin.command("ping")
+        logger.info("[database.py] MongoDB ping succeeded, connection pool warmed")
+    except Exception as e:
+        log_error("database.py", "ping_database", "pinging MongoDB at startup", e, {})
+
+
+async def ensure_indexes():
+    """
+    Create the indexes used by thread lookups and history listing.
+    Must run inside the event loop (called from the app lifespan), not at import time.
+    """
+    if threads_collection is None:
+        logger.error("[database.py] Skipping index creation: MongoDB client is not initialized")
+        return
+
+    # Each index is created separately so one failure (e.g. duplicate threadIds
+    # blocking the unique index) doesn't prevent the other
+    indexes = [
+        ("threadId (unique)", "threadId", {"unique": True}),
+        ("updatedAt (desc)", [("updatedAt", -1)], {}),
+    ]
+    for label, keys, options in indexes:
+        try:
+            await threads_collection.create_index(keys, **options)
+            logger.info(f"[database.py] Index ensured on threads: {label}")
+        except Exception as e:
+            log_error("database.py", "ensure_indexes", "creating index on threads collection", e, {"index": label})
+
+
+async def close_database():
+    """Close the MongoDB client and its connection pool. Called from the app lifespan on shutdown."""
+    if client is None:
+        return
+
+    try:
+        await client.close()
+        logger.info("[database.py] MongoDB client closed")
+    except Exception as e:
+        log_error("database.py", "close_database", "closing MongoDB client", e, {})
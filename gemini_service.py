@@ -1,20 +1,20 @@
 import os
+import re
+import asyncio
+import hashlib
+import io
+from collections import OrderedDict
+from typing import Final, List, Optional, Set, Tuple
 import google.generativeai as genai 
 from PIL import Image
-import traceback
+import aiofiles
 import logging
-import datetime
-import json
 # Imports Google's official Gemini API client library
 # google.generativeai = Google's Python package for interacting with generative AI models
 
-from dotenv import load_dotenv
+from config import load_env_once
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - [%(filename)s:%(funcName)s:%(lineno)d] - %(message)s'
-)
+# Logging is configured once in main.py
 logger = logging.getLogger(__name__)
 
 def log_error(file: str, function: str, operation: str, error: Exception, context: dict = None):
@@ -28,22 +28,22 @@ def log_error(file: str, function: str, operation: str, error: Exception, contex
         error: The exception object
         context: Additional context data
     """
-    error_info = {
-        "file": file,
-        "function": function,
-        "operation": operation,
-        "error_type": type(error).__name__,
-        "error_message": str(error),
-        "context": context or {},
-        "timestamp": datetime.datetime.utcnow().isoformat(),
-        "traceback": traceback.format_exc()
-    }
-    logger.error(f"[{file}.{function}] Error during {operation}: {json.dumps(error_info, indent=2, default=str)}")
-    return error_info
-
-load_dotenv()
-
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    # Traceback and message are only formatted if a handler actually emits the record
+    logger.error(
+        "[%s.%s] Error during %s: %s: %s | context: %s",
+        file, function, operation, type(error).__name__, error, context or {},
+        exc_info=error,
+        extra={"context": context or {}}
+    )
+
+load_env_once()
+
+GEMINI_API_KEY: Final[Optional[str]] = os.getenv("GEMINI_API_KEY")
+
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
+
+# Shared model instance, created once and reused by every request (handles text and images)
+MODEL: Optional[genai.GenerativeModel] = None
 
 # Validate API key on startup
 if GEMINI_API_KEY:
@@ -53,14 +53,331 @@ if GEMINI_API_KEY:
         logger.info("[gemini_service.py] Gemini API configured successfully")
     except Exception as config_error:
         log_error("gemini_service.py", "startup", "configuring Gemini API", config_error, {})
+    try:
+        MODEL = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        logger.info(f"[gemini_service.py] Gemini model initialized: {GEMINI_MODEL_NAME}")
+    except Exception as model_error:
+        log_error("gemini_service.py", "startup", "initializing Gemini model", model_error, {
+            "model_name": GEMINI_MODEL_NAME
+        })
 else:
     logger.warning("[gemini_service.py] WARNING: GEMINI_API_KEY not found in environment variables!")
 
 
+class GeminiServiceError(Exception):
+    """Raised with a user-facing message when a Gemini request cannot be completed."""
+
+
+# Micro-batching of concurrent text-only requests (opt-in: batched prompts from different
+# users share one model context, so one user's prompt can read or steer another's answer)
+def _int_env(name: str, default: int) -> int:
+    """Read an integer setting from the environment, falling back to the default on bad values."""
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        logger.warning(f"[gemini_service.py] Invalid {name}={raw!r}, using default {default}")
+        return default
+
+
+GEMINI_BATCH_SIZE: Final[int] = _int_env("GEMINI_BATCH_SIZE", 1)
+GEMINI_FLUSH_MS: Final[int] = _int_env("GEMINI_FLUSH_MS", 50)
+BATCH_ANSWER_MARKER = "<<<ANSWER {index}>>>"
+_BATCH_ANSWER_RE = re.compile(r"<<<ANSWER (\d+)>>>")
+
+_batch_queue: Optional[asyncio.Queue] = None
+_batch_worker: Optional[asyncio.Task] = None
+_batch_dispatches: Set[asyncio.Task] = set()
+
+
+def _finished_normally(response) -> bool:
+    """Return True if Gemini stopped on its own rather than on the token limit, safety filter, etc."""
+    try:
+        reason = response.candidates[0].finish_reason
+    except (AttributeError, IndexError):
+        return False
+    return getattr(reason, "name", reason) in ("STOP", 1)
+
+
+async def _generate_text(prompt: str, context: dict, require_complete: bool = False) -> str:
+    """
+    Send a single text prompt to Gemini.
+    
+    Args:
+        prompt: Fully built prompt text
+        context: Extra data included in error logs
+        require_complete: Fail if the response was cut off (finish reason other than STOP)
+    
+    Returns:
+        AI response text
+    
+    Raises:
+        GeminiServiceError: With a user-facing message if the request fails
+    """
+    function_name = "_generate_text"
+    
+    model = MODEL
+    if model is None:
+        logger.error(f"[gemini_service.py.{function_name}] Gemini model is not initialized")
+        raise GeminiServiceError("Error: Failed to initialize AI model. Please try again later.")
+    
+    logger.info(f"[gemini_service.py.{function_name}] Sending prompt to Gemini (length: {len(prompt)})")
+    
+    # Make API call
+    try:
+        response = await model.generate_content_async(prompt)
+    except Exception as api_error:
+        log_error("gemini_service.py", function_name, "calling Gemini API", api_error, context)
+        raise GeminiServiceError(f"Sorry, I encountered an error contacting the AI service. Error: {str(api_error)}") from api_error
+    
+    # Validate response (response.text raises ValueError when the reply was blocked, e.g. by safety filters)
+    try:
+        text = response.text if response else None
+    except ValueError as blocked_error:
+        log_error("gemini_service.py", function_name, "reading Gemini response text", blocked_error, context)
+        raise GeminiServiceError("Sorry, the AI could not answer this request. Please try rephrasing it.") from blocked_error
+    if text is None:
+        logger.error(f"[gemini_service.py.{function_name}] Invalid response from Gemini - no text")
+        raise GeminiServiceError("Sorry, I received an invalid response from the AI. Please try again.")
+    
+    if require_complete and not _finished_normally(response):
+        logger.warning(f"[gemini_service.py.{function_name}] Gemini response was not complete")
+        raise GeminiServiceError("Sorry, I received an incomplete response from the AI. Please try again.")
+    
+    return text
+
+
+def _build_batch_prompt(prompts: List[str]) -> str:
+    """Combine independent prompts into one request whose answers can be split apart again."""
+    sections = [
+        f"You will receive {len(prompts)} independent user requests. Answer each one separately and completely, "
+        f"following its own instructions. Start each answer with its marker on its own line, exactly as shown "
+        f"(for example {BATCH_ANSWER_MARKER.format(index=1)}), and do not write anything before the first marker."
+    ]
+    for index, prompt in enumerate(prompts, start=1):
+        sections.append(f"--- REQUEST {index} ---\n{prompt}")
+    return "\n\n".join(sections)
+
+
+def _split_batch_response(text: str, count: int) -> Optional[List[str]]:
+    """Split a batched response into per-request answers, or return None if the markers don't line up."""
+    parts = _BATCH_ANSWER_RE.split(text)
+    # parts = [preamble, "1", answer1, "2", answer2, ...]
+    indices = [int(index) for index in parts[1::2]]
+    answers = [answer.strip() for answer in parts[2::2]]
+    if indices != list(range(1, count + 1)) or not all(answers):
+        return None
+    return answers
+
+
+async def _dispatch_batch(batch: List[Tuple[str, asyncio.Future]]) -> None:
+    """Resolve every future in the batch, using one Gemini call when possible."""
+    function_name = "_dispatch_batch"
+    prompts = [prompt for prompt, _ in batch]
+    results: List[object] = []
+    
+    try:
+        if len(batch) > 1:
+            logger.info(f"[gemini_service.py.{function_name}] Sending batch of {len(batch)} prompts to Gemini")
+            try:
+                # A truncated reply can still contain every marker, so require a normal finish
+                combined = await _generate_text(_build_batch_prompt(prompts), {"batch_size": len(batch)}, require_complete=True)
+                answers = _split_batch_response(combined, len(batch))
+                if answers is not None:
+                    results = answers
+                else:
+                    logger.warning(f"[gemini_service.py.{function_name}] Could not split batched response, falling back to per-request calls")
+            except Exception:
+                # Any batched failure (one user's prompt getting the batch blocked included) falls back
+                logger.warning(f"[gemini_service.py.{function_name}] Batched request failed, falling back to per-request calls")
+        
+        if not results:
+            results = await asyncio.gather(
+                *(_generate_text(prompt, {"prompt_length": len(prompt)}) for prompt in prompts),
+                return_exceptions=True
+            )
+    except Exception as e:
+        log_error("gemini_service.py", function_name, "dispatching batch", e, {"batch_size": len(batch)})
+        results = [e] * len(batch)
+    
+    for (_, future), result in zip(batch, results):
+        if future.done():
+            continue  # Caller went away (e.g. WebSocket closed)
+        if isinstance(result, BaseException):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
+def _fail_pending(batch: List[Tuple[str, asyncio.Future]]) -> None:
+    """Fail futures that will never be dispatched so their callers don't hang."""
+    for _, future in batch:
+        if not future.done():
+            future.set_exception(GeminiServiceError("Sorry, the AI service is shutting down. Please try again."))
+
+
+async def _run_batch_worker() -> None:
+    """Drain the queue into batches of up to GEMINI_BATCH_SIZE, waiting at most GEMINI_FLUSH_MS for a batch to fill."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = []
+        try:
+            batch.append(await _batch_queue.get())
+            deadline = loop.time() + GEMINI_FLUSH_MS / 1000
+            while len(batch) < GEMINI_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(_batch_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            _fail_pending(batch)
+            raise
+        
+        # Dispatch without blocking so the next batch can start filling
+        task = asyncio.create_task(_dispatch_batch(batch))
+        _batch_dispatches.add(task)
+        task.add_done_callback(_batch_dispatches.discard)
+
+
+async def start_batch_worker() -> None:
+    """Start the background task that batches concurrent text requests. Call from the app lifespan."""
+    global _batch_queue, _batch_worker
+    if _batch_worker is not None:
+        return
+    if GEMINI_BATCH_SIZE <= 1:
+        logger.info("[gemini_service.py] Batching disabled (GEMINI_BATCH_SIZE <= 1), sending prompts directly")
+        return
+    _batch_queue = asyncio.Queue()
+    _batch_worker = asyncio.create_task(_run_batch_worker())
+    logger.info(f"[gemini_service.py] Batch worker started (batch size: {GEMINI_BATCH_SIZE}, flush: {GEMINI_FLUSH_MS} ms)")
+
+
+async def stop_batch_worker() -> None:
+    """Stop the batch worker, fail requests still queued, and wait for in-flight batches to finish."""
+    global _batch_queue, _batch_worker
+    if _batch_worker is None:
+        return
+    _batch_worker.cancel()
+    try:
+        await _batch_worker
+    except asyncio.CancelledError:
+        pass
+    
+    queued = []
+    while not _batch_queue.empty():
+        queued.append(_batch_queue.get_nowait())
+    _fail_pending(queued)
+    
+    if _batch_dispatches:
+        await asyncio.gather(*_batch_dispatches, return_exceptions=True)
+    _batch_queue = None
+    _batch_worker = None
+    logger.info("[gemini_service.py] Batch worker stopped")
+
+
+# Reply caches for repeated queries; failed requests are never cached
+TEXT_CACHE_SIZE: Final[int] = 2048
+IMAGE_CACHE_SIZE: Final[int] = 256
+IMAGE_CACHE_MAX_BYTES: Final[int] = 1024 * 1024  # Larger images are not hashed or cached
+
+_text_reply_cache: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_image_reply_cache: "OrderedDict[Tuple[str, str, str], str]" = OrderedDict()
+
+
+def _cache_get(cache: OrderedDict, key: tuple) -> Optional[str]:
+    """Look up a cached reply and mark it as most recently used."""
+    reply = cache.get(key)
+    if reply is not None:
+        cache.move_to_end(key)
+    return reply
+
+
+def _cache_put(cache: OrderedDict, key: tuple, reply: str, max_size: int) -> None:
+    """Store a reply, evicting the least recently used entry when over max_size."""
+    cache[key] = reply
+    cache.move_to_end(key)
+    if len(cache) > max_size:
+        cache.popitem(last=False)
+
+
+async def _fetch_text_reply(language: str, message: str) -> str:
+    """
+    Get a reply for a text message (uncached).
+    
+    Raises:
+        GeminiServiceError: If the request fails
+    """
+    prompt = f"Respond in {language}. User query: {message}"
+    
+    if _batch_queue is not None:
+        future = asyncio.get_running_loop().create_future()
+        await _batch_queue.put((prompt, future))
+        return await future
+    
+    return await _generate_text(prompt, {
+        "language": language,
+        "message_length": len(message)
+    })
+
+
+# Image types Gemini accepts as raw inline bytes; other supported uploads are converted to PNG
+GEMINI_INLINE_MIME_TYPES: Final[Set[str]] = {"image/jpeg", "image/png", "image/webp"}
+
+
+def detect_image_mime(header: bytes) -> Optional[str]:
+    """
+    Identify an image type from its leading bytes (magic number).
+    
+    Args:
+        header: At least the first 12 bytes of the file
+    
+    Returns:
+        MIME type for JPEG, PNG, GIF or WebP, or None if the signature is not recognized
+    """
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _sha256_hex(data: bytes) -> str:
+    """Return the SHA-256 hex digest of the given bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _convert_to_png(data: bytes) -> bytes:
+    """Re-encode an image Gemini can't take inline (e.g. GIF) as PNG (first frame only)."""
+    with Image.open(io.BytesIO(data)) as img:
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+def clear_gemini_cache():
+    """Drop all cached text and image replies."""
+    _text_reply_cache.clear()
+    _image_reply_cache.clear()
+    logger.info("[gemini_service.py] Gemini reply caches cleared")
+
+
 async def get_gemini_response(message: str, language: str = "English") -> str:
     """
     Get a text-only response from Gemini in the specified language.
     
+    Replies are cached per (language, normalized message). Concurrent calls are
+    coalesced into a single Gemini request by the batch worker when it is
+    running; otherwise the prompt is sent directly.
+    
     Args:
         message: User's message/query
         language: Target language for response (default: English)
@@ -83,37 +400,21 @@ async def get_gemini_response(message: str, language: str = "English") -> str:
     try:
         logger.info(f"[gemini_service.py.{function_name}] Starting request - Language: {language}, Message length: {len(message)}")
         
-        # Initialize model
-        try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-        except Exception as model_error:
-            log_error("gemini_service.py", function_name, "initializing Gemini model", model_error, {
-                "model_name": "gemini-2.5-flash"
-            })
-            return f"Error: Failed to initialize AI model. Please try again later."
-        
-        # Add language instruction to the prompt
-        prompt = f"Respond in {language}. User query: {message}"
-        logger.info(f"[gemini_service.py.{function_name}] Sending prompt to Gemini (length: {len(prompt)})")
+        # Identical queries (ignoring case and surrounding whitespace) share a cached reply;
+        # the normalized text is only the key, the original message is what gets sent
+        cache_key = (language, message.strip().lower())
+        reply = _cache_get(_text_reply_cache, cache_key)
+        if reply is None:
+            reply = await _fetch_text_reply(language, message)
+            _cache_put(_text_reply_cache, cache_key, reply, TEXT_CACHE_SIZE)
+        else:
+            logger.info(f"[gemini_service.py.{function_name}] Returning cached reply")
         
-        # Make API call
-        try:
-            response = await model.generate_content_async(prompt)
-        except Exception as api_error:
-            log_error("gemini_service.py", function_name, "calling Gemini API", api_error, {
-                "language": language,
-                "message_length": len(message)
-            })
-            return f"Sorry, I encountered an error contacting the AI service. Error: {str(api_error)}"
-        
-        # Validate response
-        if not response or not hasattr(response, 'text'):
-            logger.error(f"[gemini_service.py.{function_name}] Invalid response from Gemini - no text attribute")
-            return "Sorry, I received an invalid response from the AI. Please try again."
-        
-        logger.info(f"[gemini_service.py.{function_name}] Response received successfully - Length: {len(response.text)}")
-        return response.text
+        logger.info(f"[gemini_service.py.{function_name}] Response received successfully - Length: {len(reply)}")
+        return reply
         
+    except GeminiServiceError as service_error:
+        return str(service_error)
     except Exception as e:
         log_error("gemini_service.py", function_name, "get_gemini_response", e, {
             "language": language,
@@ -145,39 +446,57 @@ async def get_gemini_response_with_image(message: str, image_path: str, language
     if not image_path:
         logger.error(f"[gemini_service.py.{function_name}] No image path provided")
         return "Error: No image path provided for multimodal request."
-    
-    if not os.path.exists(image_path):
-        logger.error(f"[gemini_service.py.{function_name}] Image file not found: {image_path}")
-        return f"Error: Image file not found at path: {image_path}"
 
     try:
         logger.info(f"[gemini_service.py.{function_name}] Starting multimodal request - Image: {image_path}, Language: {language}")
         
-        # Load the image using PIL
+        # Read the raw bytes; Gemini takes them as-is, so the image is never decoded here
         try:
-            img = Image.open(image_path)
-            img_format = img.format
-            img_size = img.size
-            logger.info(f"[gemini_service.py.{function_name}] Image loaded - Format: {img_format}, Size: {img_size}")
+            async with aiofiles.open(image_path, "rb") as f:
+                image_data = await f.read()
         except FileNotFoundError as fnf_error:
             log_error("gemini_service.py", function_name, "loading image file", fnf_error, {
                 "image_path": image_path
             })
             return f"Error: Image file not found: {image_path}"
-        except Exception as img_error:
-            log_error("gemini_service.py", function_name, "opening image with PIL", img_error, {
+        except Exception as read_error:
+            log_error("gemini_service.py", function_name, "reading image file", read_error, {
                 "image_path": image_path
             })
             return f"Error: Could not open image file. The file may be corrupted or in an unsupported format."
         
-        # Initialize vision-capable model
-        try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-        except Exception as model_error:
-            log_error("gemini_service.py", function_name, "initializing Gemini vision model", model_error, {
-                "model_name": "gemini-2.5-flash"
-            })
-            return f"Error: Failed to initialize AI model for image processing."
+        # Validate the file signature instead of decoding the whole image
+        mime_type = detect_image_mime(image_data[:32])
+        if mime_type is None:
+            logger.error(f"[gemini_service.py.{function_name}] Unrecognized image signature: {image_path}")
+            return f"Error: Could not open image file. The file may be corrupted or in an unsupported format."
+        logger.info(f"[gemini_service.py.{function_name}] Image loaded - Type: {mime_type}, Size: {len(image_data)} bytes")
+        
+        # Check the reply cache for small images (hashing runs off the event loop)
+        cache_key = None
+        if len(image_data) <= IMAGE_CACHE_MAX_BYTES:
+            image_digest = await asyncio.to_thread(_sha256_hex, image_data)
+            cache_key = (language, message or "", image_digest)
+            cached_reply = _cache_get(_image_reply_cache, cache_key)
+            if cached_reply is not None:
+                logger.info(f"[gemini_service.py.{function_name}] Returning cached reply for image: {image_path}")
+                return cached_reply
+        
+        if mime_type not in GEMINI_INLINE_MIME_TYPES:
+            try:
+                image_data = await asyncio.to_thread(_convert_to_png, image_data)
+                mime_type = "image/png"
+            except Exception as img_error:
+                log_error("gemini_service.py", function_name, "converting image to PNG", img_error, {
+                    "image_path": image_path,
+                    "mime_type": mime_type
+                })
+                return f"Error: Could not open image file. The file may be corrupted or in an unsupported format."
+        
+        model = MODEL
+        if model is None:
+            logger.error(f"[gemini_service.py.{function_name}] Gemini model is not initialized")
+            return "Error: Failed to initialize AI model for image processing."
         
         # Create multimodal prompt with text, image, and language instruction
         base_text = message if message else "Describe this image in detail."
@@ -186,7 +505,7 @@ async def get_gemini_response_with_image(message: str, image_path: str, language
         
         # Make API call with image
         try:
-            response = await model.generate_content_async([prompt_text, img])
+            response = await model.generate_content_async([prompt_text, {"mime_type": mime_type, "data": image_data}])
         except Exception as api_error:
             log_error("gemini_service.py", function_name, "calling Gemini multimodal API", api_error, {
                 "language": language,
@@ -201,6 +520,8 @@ async def get_gemini_response_with_image(message: str, image_path: str, language
             return "Sorry, I received an invalid response from the AI. Please try again."
         
         logger.info(f"[gemini_service.py.{function_name}] Multimodal response received successfully - Length: {len(response.text)}")
+        if cache_key is not None:
+            _cache_put(_image_reply_cache, cache_key, response.text, IMAGE_CACHE_SIZE)
         return response.text
         
     except Exception as e:
@@ -1,23 +1,33 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import List, Optional
-import json
+from typing import Dict, List, Optional
+from contextlib import asynccontextmanager
+import orjson
+import asyncio
 import datetime
 import os
 import uuid
-import traceback
+import hmac
+import hashlib
+import secrets
+import time
 import logging
-from database import threads_collection
-from gemini_service import get_gemini_response, get_gemini_response_with_image
-from chat_data import chat_data
+import aiofiles
+from urllib.parse import urlsplit, parse_qs
 
-# Configure logging for better debugging
+# Configure logging for the whole app (before importing modules that log at import time)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - [%(filename)s:%(funcName)s:%(lineno)d] - %(message)s'
 )
+
+from database import threads_collection, ensure_indexes, ping_database, close_database
+from gemini_service import get_gemini_response, get_gemini_response_with_image, start_batch_worker, stop_batch_worker, detect_image_mime
+from chat_data import chat_data
+from config import load_env_once
+
 logger = logging.getLogger(__name__)
 
 def log_error(file: str, function: str, operation: str, error: Exception, context: dict = None):
@@ -31,28 +41,90 @@ def log_error(file: str, function: str, operation: str, error: Exception, contex
         error: The exception object
         context: Additional context data
     """
-    error_info = {
-        "file": file,
-        "function": function,
-        "operation": operation,
-        "error_type": type(error).__name__,
-        "error_message": str(error),
-        "context": context or {},
-        "timestamp": datetime.datetime.utcnow().isoformat(),
-        "traceback": traceback.format_exc()
-    }
-    logger.error(f"[{file}.{function}] Error during {operation}: {json.dumps(error_info, indent=2, default=str)}")
-    return error_info
+    # Traceback and message are only formatted if a handler actually emits the record
+    logger.error(
+        "[%s.%s] Error during %s: %s: %s | context: %s",
+        file, function, operation, type(error).__name__, error, context or {},
+        exc_info=error,
+        extra={"context": context or {}}
+    )
+
+def _dumps(obj) -> str:
+    """Serialize an outgoing WebSocket payload with orjson."""
+    return orjson.dumps(obj).decode()
+
+# Local responses keyed by lowercase question, built once for O(1) lookup per message
+CHAT_DATA_CI = {key.lower(): value for key, value in chat_data.items()}
 
 # Ensure uploads directory exists
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Bytes read per chunk when streaming uploads to disk
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10 MB
+IMAGE_SIGNATURE_SIZE = 16  # Leading bytes read to identify the image type
+IMAGE_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp"}
+SEND_QUEUE_SIZE = 32  # Max outgoing messages buffered per WebSocket client
 try:
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     logger.info(f"[main.py] Upload directory ready: {UPLOAD_DIR}")
 except Exception as e:
     log_error("main.py", "startup", "creating upload directory", e, {"path": UPLOAD_DIR})
 
-app = FastAPI()
+# Secret for signing upload URLs, so image paths sent over the WebSocket can be trusted without a stat
+load_env_once()
+UPLOAD_TOKEN_LENGTH = 16
+UPLOAD_TOKEN_TTL = 60 * 60  # Seconds a signed upload URL stays valid for sending in chat
+_upload_token_secret = os.getenv("UPLOAD_TOKEN_SECRET")
+if _upload_token_secret:
+    UPLOAD_TOKEN_SECRET = _upload_token_secret.encode()
+elif int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+    # Each worker would sign with its own random secret and reject the others' upload URLs
+    raise RuntimeError("UPLOAD_TOKEN_SECRET must be set when running more than one worker (WEB_CONCURRENCY > 1)")
+else:
+    UPLOAD_TOKEN_SECRET = secrets.token_bytes(32)
+    logger.warning("[main.py] UPLOAD_TOKEN_SECRET not set; using a per-process secret. "
+                   "Upload URLs won't validate across restarts.")
+
+def _upload_signature(filename: str, expires: int) -> str:
+    """Short HMAC-SHA256 over the filename and expiry time."""
+    message = f"{filename}:{expires}".encode()
+    return hmac.new(UPLOAD_TOKEN_SECRET, message, hashlib.sha256).hexdigest()[:UPLOAD_TOKEN_LENGTH]
+
+def _sign_upload(filename: str) -> str:
+    """Short-lived token ("<expires>.<signature>") proving this server wrote the given upload."""
+    expires = int(time.time()) + UPLOAD_TOKEN_TTL
+    return f"{expires}.{_upload_signature(filename, expires)}"
+
+def _resolve_upload(image_url: str) -> Optional[str]:
+    """
+    Map a signed upload URL (/uploads/<file>?token=<expires>.<signature>) to its local path.
+    
+    Returns:
+        Local file path, or None if the token is missing, doesn't match, or has expired
+    """
+    parts = urlsplit(image_url)
+    filename = os.path.basename(parts.path)  # basename keeps the path inside UPLOAD_DIR
+    token = parse_qs(parts.query).get("token", [""])[0]
+    expires_text, _, signature = token.partition(".")
+    if not filename or not expires_text.isdigit() or not signature:
+        return None
+    expires = int(expires_text)
+    if not hmac.compare_digest(_upload_signature(filename, expires), signature):
+        return None
+    if expires < time.time():
+        return None
+    return os.path.join(UPLOAD_DIR, filename)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop background services alongside the application."""
+    await ping_database()
+    await ensure_indexes()
+    await start_batch_worker()
+    yield
+    await stop_batch_worker()
+    await close_database()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -73,7 +145,7 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "timestamp": datetime.datetime.utcnow().isoformat()}
+    return {"status": "healthy", "timestamp": datetime.datetime.now(datetime.UTC).isoformat()}
 
 # Serve uploaded files as static
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
@@ -93,21 +165,62 @@ class Thread(BaseModel):
 # --- Websocket Manager ---
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        # Outgoing message queue per connection, drained by one writer task each,
+        # so a slow client never blocks the handler between DB writes and Gemini calls
+        self.active_connections: Dict[WebSocket, asyncio.Queue] = {}
+        self._writers: Dict[WebSocket, asyncio.Task] = {}
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.active_connections[websocket] = queue
+        self._writers[websocket] = asyncio.create_task(self._write_loop(websocket, queue))
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        self.active_connections.pop(websocket, None)
+        writer = self._writers.pop(websocket, None)
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+
+    async def _write_loop(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Send queued payloads to the client in order until the connection goes away."""
+        try:
+            while True:
+                payload = await queue.get()
+                await websocket.send_text(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_error("main.py", "ConnectionManager._write_loop", "sending queued message", e, {
+                "queued": queue.qsize()
+            })
+            self.disconnect(websocket)
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        """Queue a serialized message for the client; a client that falls too far behind is disconnected."""
+        queue = self.active_connections.get(websocket)
+        if queue is None:
+            raise RuntimeError("WebSocket is not connected")
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning(f"[main.py.send_personal_message] Send queue full ({SEND_QUEUE_SIZE}), closing slow client")
+            self.disconnect(websocket)
+            try:
+                await websocket.close(code=1013)  # Try Again Later
+            except Exception:
+                pass  # Connection already closing
 
 manager = ConnectionManager()
 
 # --- Image Upload Endpoint ---
+def _remove_partial_upload(file_path: str):
+    """Delete a partially written upload, ignoring errors."""
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
 @app.post("/api/upload")
 async def upload_image(file: UploadFile = File(...)):
     """Upload an image file and return its URL."""
@@ -122,34 +235,57 @@ async def upload_image(file: UploadFile = File(...)):
             logger.warning(f"[main.py.{function_name}] Invalid file type: {file.content_type}")
             raise HTTPException(status_code=400, detail=f"Invalid file type: {file.content_type}. Allowed: JPEG, PNG, GIF, WebP")
         
-        # Generate unique filename
-        file_ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-        unique_filename = f"{uuid.uuid4()}.{file_ext}"
+        # Reject oversized uploads before touching disk when the size is known up front
+        if file.size is not None and file.size > MAX_UPLOAD_SIZE:
+            logger.warning(f"[main.py.{function_name}] File too large: {file.size} bytes")
+            raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {MAX_UPLOAD_SIZE // (1024 * 1024)} MB")
+        
+        # Check the file signature; content_type is client-supplied and can't be trusted
+        header = await file.read(IMAGE_SIGNATURE_SIZE)
+        mime_type = detect_image_mime(header)
+        if mime_type is None:
+            logger.warning(f"[main.py.{function_name}] File content is not a supported image: {file.filename}")
+            raise HTTPException(status_code=415, detail="File content is not a valid JPEG, PNG, GIF or WebP image")
+        
+        # Generate unique filename; the extension comes from the detected type so it can be trusted later
+        unique_filename = f"{uuid.uuid4()}.{IMAGE_EXTENSIONS[mime_type]}"
         file_path = os.path.join(UPLOAD_DIR, unique_filename)
         
-        logger.info(f"[main.py.{function_name}] Saving file to: {file_path}")
+        logger.info(f"[main.py.{function_name}] Saving {mime_type} file to: {file_path}")
         
-        # Save file
+        # Stream file to disk in chunks to keep memory bounded and the event loop free
+        total = len(header)
         try:
-            contents = await file.read()
-            with open(file_path, "wb") as f:
-                f.write(contents)
-            logger.info(f"[main.py.{function_name}] File saved successfully: {unique_filename}, size: {len(contents)} bytes")
+            async with aiofiles.open(file_path, "wb") as f:
+                await f.write(header)
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    total += len(chunk)
+                    if total > MAX_UPLOAD_SIZE:
+                        logger.warning(f"[main.py.{function_name}] File exceeded size limit while streaming: {file.filename}")
+                        raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {MAX_UPLOAD_SIZE // (1024 * 1024)} MB")
+                    await f.write(chunk)
+            logger.info(f"[main.py.{function_name}] File saved successfully: {unique_filename}, size: {total} bytes")
+        except HTTPException:
+            _remove_partial_upload(file_path)
+            raise
         except IOError as io_error:
+            _remove_partial_upload(file_path)
             log_error("main.py", function_name, "writing file to disk", io_error, {
                 "file_path": file_path,
                 "filename": file.filename
             })
             raise HTTPException(status_code=500, detail=f"Failed to save file to disk: {str(io_error)}")
         except Exception as e:
+            _remove_partial_upload(file_path)
             log_error("main.py", function_name, "reading/saving file", e, {
                 "filename": file.filename,
                 "content_type": file.content_type
             })
             raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
         
-        # Return URL for the uploaded file
-        return {"url": f"/uploads/{unique_filename}", "path": file_path}
+        # Return signed URL for the uploaded file; clients send it back as-is in the "image" field
+        token = _sign_upload(unique_filename)
+        return {"url": f"/uploads/{unique_filename}?token={token}", "path": file_path, "mimeType": mime_type, "token": token}
         
     except HTTPException:
         raise  # Re-raise HTTP exceptions as-is
@@ -162,6 +298,41 @@ async def upload_image(file: UploadFile = File(...)):
 
 
 # --- WebSocket Endpoint (Multiplexed - Single Connection for All Threads) ---
+async def _save_user_message(thread_id: str, message_doc: dict, thread_insert_fields: dict, client_id: str):
+    """Append the user message to its thread (creating the thread if needed), logging any failure."""
+    function_name = "_save_user_message"
+    
+    try:
+        await threads_collection.update_one(
+            {"threadId": thread_id},
+            {
+                "$push": {"messages": message_doc},
+                "$set": {"updatedAt": message_doc["timestamp"]},
+                "$setOnInsert": thread_insert_fields
+            },
+            upsert=True
+        )
+    except Exception as db_error:
+        log_error("main.py", function_name, "saving user message to database", db_error, {
+            "thread_id": thread_id,
+            "client_id": client_id
+        })
+        # Continue anyway to try to respond
+
+async def _generate_reply(user_message: str, image_path: Optional[str], language: str, local_response: Optional[str], thread_id: str) -> str:
+    """Pick the reply source for a message: local data, multimodal Gemini, or text-only Gemini."""
+    function_name = "_generate_reply"
+    
+    if local_response:
+        return local_response
+    if image_path:
+        # Use multimodal Gemini for images with language
+        logger.info(f"[main.py.{function_name}] Calling Gemini with image for thread: {thread_id}")
+        return await get_gemini_response_with_image(user_message, image_path, language)
+    # Text-only Gemini with language
+    logger.info(f"[main.py.{function_name}] Calling Gemini for text for thread: {thread_id}")
+    return await get_gemini_response(user_message, language)
+
 @app.websocket("/ws/chat")
 async def websocket_endpoint(websocket: WebSocket):
     """
@@ -187,7 +358,6 @@ async def websocket_endpoint(websocket: WebSocket):
                 logger.info(f"[main.py.{function_name}] Client {client_id} received message: {data[:100]}...")
             except WebSocketDisconnect:
                 logger.info(f"[main.py.{function_name}] Client {client_id} disconnected normally")
-                manager.disconnect(websocket)
                 return
             except Exception as recv_error:
                 log_error("main.py", function_name, "receiving WebSocket message", recv_error, {"client_id": client_id})
@@ -196,24 +366,25 @@ async def websocket_endpoint(websocket: WebSocket):
             # Parse incoming data - must be JSON with threadId
             thread_id = None
             user_message = ""
+            image_url = None
             image_path = None
             language = "English"  # Default language
             
             try:
-                parsed = json.loads(data)
+                parsed = orjson.loads(data)
                 if isinstance(parsed, dict):
                     thread_id = parsed.get("threadId")
                     user_message = parsed.get("content", "")
                     image_url = parsed.get("image", None)
                     language = parsed.get("language", "English")  # Extract language
                     if image_url:
-                        # Convert URL to local file path
-                        image_path = os.path.join(UPLOAD_DIR, image_url.split("/uploads/")[-1])
+                        # Convert signed URL to local file path (no stat: the token proves we wrote it)
+                        image_path = _resolve_upload(image_url)
                     logger.info(f"[main.py.{function_name}] Parsed message - thread: {thread_id}, language: {language}, has_image: {bool(image_url)}")
                 else:
                     logger.warning(f"[main.py.{function_name}] Invalid message format (not a dict): {data[:50]}")
                     continue
-            except json.JSONDecodeError as json_error:
+            except orjson.JSONDecodeError as json_error:
                 log_error("main.py", function_name, "parsing JSON message", json_error, {
                     "client_id": client_id,
                     "raw_data": data[:100]
@@ -225,93 +396,82 @@ async def websocket_endpoint(websocket: WebSocket):
                 logger.warning(f"[main.py.{function_name}] Missing threadId in message from client {client_id}")
                 try:
                     await manager.send_personal_message(
-                        json.dumps({"error": "Missing threadId"}), 
+                        _dumps({"error": "Missing threadId"}), 
                         websocket
                     )
                 except Exception as send_error:
                     log_error("main.py", function_name, "sending error response", send_error, {"client_id": client_id})
                 continue
 
-            # 1. Save User Message to DB
-            try:
-                message_doc = {
-                    "role": "user",
-                    "content": user_message,
-                    "timestamp": datetime.datetime.utcnow()
-                }
-                if image_path:
-                    message_doc["image"] = f"/uploads/{os.path.basename(image_path)}"
-                
-                # Find or Create Thread
-                existing_thread = await threads_collection.find_one({"threadId": thread_id})
-                
-                title_text = user_message[:30] if user_message else "Image message"
-                if not existing_thread:
-                    logger.info(f"[main.py.{function_name}] Creating new thread: {thread_id}")
-                    new_thread = {
-                        "threadId": thread_id,
-                        "title": title_text,
-                        "messages": [message_doc],
-                        "createdAt": datetime.datetime.utcnow(),
-                        "updatedAt": datetime.datetime.utcnow()
-                    }
-                    await threads_collection.insert_one(new_thread)
-                else:
-                    logger.info(f"[main.py.{function_name}] Updating existing thread: {thread_id}")
-                    await threads_collection.update_one(
-                        {"threadId": thread_id},
-                        {"$push": {"messages": message_doc}, "$set": {"updatedAt": datetime.datetime.utcnow()}}
+            # Reject images whose upload token doesn't verify rather than answering as text-only
+            if image_url and image_path is None:
+                logger.warning(f"[main.py.{function_name}] Invalid or missing image token from client {client_id}: {image_url[:100]}")
+                try:
+                    await manager.send_personal_message(
+                        _dumps({"threadId": thread_id, "error": "Invalid or expired image token"}),
+                        websocket
                     )
-            except Exception as db_error:
-                log_error("main.py", function_name, "saving user message to database", db_error, {
-                    "thread_id": thread_id,
-                    "client_id": client_id
-                })
-                # Continue anyway to try to respond
+                except Exception as send_error:
+                    log_error("main.py", function_name, "sending error response", send_error, {
+                        "thread_id": thread_id,
+                        "client_id": client_id
+                    })
+                continue
 
-            # 2. Determine Response (Local Data vs Gemini)
-            clean_text = user_message.lower().strip() if user_message else ""
+            # 1. Build User Message (one timestamp shared by every write this turn)
+            now = datetime.datetime.now(datetime.UTC)
+            message_doc = {
+                "role": "user",
+                "content": user_message,
+                "timestamp": now
+            }
+            if image_path:
+                message_doc["image"] = f"/uploads/{os.path.basename(image_path)}"
             
-            # Check local data (case-insensitive keys)
-            local_response = None
-            if clean_text:
-                for key in chat_data:
-                    if key.lower() == clean_text:
-                        local_response = chat_data[key]
-                        logger.info(f"[main.py.{function_name}] Found local response for: {clean_text[:30]}")
-                        break
+            # Fields set only when this message creates the thread
+            title_text = user_message[:30] if user_message else "Image message"
+            thread_insert_fields = {"threadId": thread_id, "title": title_text, "createdAt": now}
+
+            # 2. Check local data (case-insensitive keys)
+            clean_text = user_message.lower().strip() if user_message else ""
+            local_response = CHAT_DATA_CI.get(clean_text) if clean_text else None
+            if local_response:
+                logger.info(f"[main.py.{function_name}] Found local response for: {clean_text[:30]}")
+
+            # 3. Save User Message to DB and get the response concurrently
+            # (_save_user_message handles its own errors, so a DB failure never blocks the reply)
+            _, reply_result = await asyncio.gather(
+                _save_user_message(thread_id, message_doc, thread_insert_fields, client_id),
+                _generate_reply(user_message, image_path, language, local_response, thread_id),
+                return_exceptions=True
+            )
             
-            assistant_reply = ""
-            try:
-                if local_response:
-                    assistant_reply = local_response
-                elif image_path and os.path.exists(image_path):
-                    # Use multimodal Gemini for images with language
-                    logger.info(f"[main.py.{function_name}] Calling Gemini with image for thread: {thread_id}")
-                    assistant_reply = await get_gemini_response_with_image(user_message, image_path, language)
-                else:
-                    # Text-only Gemini with language
-                    logger.info(f"[main.py.{function_name}] Calling Gemini for text for thread: {thread_id}")
-                    assistant_reply = await get_gemini_response(user_message, language)
-            except Exception as ai_error:
-                log_error("main.py", function_name, "getting AI response", ai_error, {
+            if isinstance(reply_result, BaseException):
+                log_error("main.py", function_name, "getting AI response", reply_result, {
                     "thread_id": thread_id,
                     "has_image": bool(image_path),
                     "language": language
                 })
                 assistant_reply = f"Sorry, I encountered an error processing your request. Please try again."
+            else:
+                assistant_reply = reply_result
 
-            # 3. Save Assistant Message to DB
+            # 4. Save Assistant Message to DB (upsert in case the user message write failed)
             try:
                 assistant_doc = {
                     "role": "assistant",
                     "content": assistant_reply,
-                    "timestamp": datetime.datetime.utcnow()
+                    "timestamp": now
                 }
                 
                 await threads_collection.update_one(
                     {"threadId": thread_id},
-                    {"$push": {"messages": assistant_doc}, "$set": {"updatedAt": datetime.datetime.utcnow()}}
+                    {
+                        "$push": {"messages": assistant_doc},
+                        "$set": {"updatedAt": now},
+                        "$setOnInsert": thread_insert_fields
+                    },
+                    upsert=True
                 )
                 logger.info(f"[main.py.{function_name}] Saved assistant response to thread: {thread_id}")
             except Exception as db_error:
@@ -320,10 +480,10 @@ async def websocket_endpoint(websocket: WebSocket):
                     "reply_length": len(assistant_reply)
                 })
 
-            # 4. Send Response back to Client (include threadId for multiplexing)
+            # 5. Send Response back to Client (include threadId for multiplexing)
             try:
                 await manager.send_personal_message(
-                    json.dumps({"threadId": thread_id, "reply": assistant_reply}), 
+                    _dumps({"threadId": thread_id, "reply": assistant_reply}), 
                     websocket
                 )
                 logger.info(f"[main.py.{function_name}] Sent response to client {client_id} for thread: {thread_id}")
@@ -335,27 +495,34 @@ async def websocket_endpoint(websocket: WebSocket):
 
     except WebSocketDisconnect:
         logger.info(f"[main.py.{function_name}] Client {client_id} disconnected")
-        manager.disconnect(websocket)
     except Exception as e:
         log_error("main.py", function_name, "WebSocket main loop", e, {"client_id": client_id})
+    finally:
+        # Also covers leaving the loop after a receive error, which used to skip cleanup
         manager.disconnect(websocket)
 
 
 # --- REST Endpoints for History ---
 
 @app.get("/api/thread")
-async def get_threads():
-    """Get all threads sorted by last update."""
+async def get_threads(
+    limit: int = Query(50, ge=1, le=200),
+    skip: int = Query(0, ge=0)
+):
+    """Get a page of threads (id, title, last update only) sorted by last update."""
     function_name = "get_threads"
     
     try:
-        logger.info(f"[main.py.{function_name}] Fetching all threads")
-        cursor = threads_collection.find({}).sort("updatedAt", -1)
-        threads = []
-        async for document in cursor:
-            # Convert ObjectId to string if needed, or exclude _id
+        logger.info(f"[main.py.{function_name}] Fetching threads (limit: {limit}, skip: {skip})")
+        # Only the sidebar fields are needed; messages are fetched per thread
+        cursor = threads_collection.find(
+            {},
+            projection={"threadId": 1, "title": 1, "updatedAt": 1}
+        ).sort("updatedAt", -1).skip(skip).limit(limit)
+        threads = await cursor.to_list(length=limit)
+        for document in threads:
+            # Convert ObjectId to string for JSON serialization
             document["_id"] = str(document["_id"])
-            threads.append(document)
         logger.info(f"[main.py.{function_name}] Found {len(threads)} threads")
         return threads
     except Exception as e:
@@ -415,4 +582,14 @@ async def delete_thread(thread_id: str):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8080, reload=True)
+    # loop="auto" picks uvloop when installed (not on Windows); httptools for faster HTTP parsing.
+    # Each worker opens its own Mongo pool (minPoolSize=10), so scale WEB_CONCURRENCY deliberately.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8080,
+        reload=False,
+        loop="auto",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )